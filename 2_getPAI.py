@@ -37,6 +37,7 @@ tmthrc = 0.25 #use if overcast sky. Ryu 2012 uses 0.5, but 0.25 appears more sui
 skythr = 0.75 #this is only for calculating the blue sky index, to identify sky pixels in a strict manner (i.e., skythr = 0.75). Then, if cloudy, the sky/canopy threshold is informed by tmthrc, otherwise tmthri is used. (qualitative)
 bins_in = np.arange(0,257,binsz) #bin edge counts, a greater number than the histogram bins
 fcval = 10000 #this is the threshold for filtering out find contours, only use larger ones than this number. It is is only indirectly related to pixel count, 10k seems to be close to > 1.3% image pixels for our 2304 x (1728-skipbotpix) images. Should be scaled in line with total pixel count.
+nmsk = 2 #number of masks kept per image in the optional mask archive (-m 1): 0 = sky (arrbin==1), 1 = large gap (cimg==255)
 
 ####-------------------FUNC/METH-----------------####
 def cmdLineParse():
@@ -46,10 +47,38 @@ def cmdLineParse():
     parser = argparse.ArgumentParser( description='Screen JPG data by modify timestamp. Example: python 0_hourscreen.py -i 401cam')
     parser.add_argument('-i', '--indir', dest='indir', type=str, required=True,
                         help='The input directory where the .JPG and .csv of step 1 are. Output is a .csv listing images passing the screen.')
+    parser.add_argument('-m', '--mskarc', dest='mskarc', type=int, required=False, default = 0,
+                        help='Also archive the sky and large gap masks of each image, bit-packed, to a memory-mappable .npy starting with 2_mskarc_ (=1). Default is 0.')
     return parser.parse_args()
 
+def load_mskarc(indir):
+    '''
+    Open the mask archive of indir read-only (memory-mapped) along with its timestamp index.
+    '''
+    arc = np.load(os.path.join(indir, '2_mskarc_{0}.npy'.format(indir)), mmap_mode='r')
+    idx = pd.read_csv(os.path.join(indir, '2_mskarc_{0}.csv'.format(indir)), index_col=0, parse_dates=True)
+    return arc, idx
+
+def get_msk(arc, idx, dtm, fname=None):
+    '''
+    Unpack the sky and large gap masks (bool, nrow x ncol) stored for timestamp dtm. If several images share dtm, give their file name with fname.
+    Returns None, None if the masks were not archived (valid = -1: could not classify, valid = 0: image size differs from the archive).
+    '''
+    rec = idx.loc[[pd.Timestamp(dtm)]]
+    if fname is not None:
+        rec = rec[rec['file'] == fname]
+    if len(rec) != 1:
+        raise ValueError('{0} mask archive entries for {1} (files: {2}), specify one with fname'.format(len(rec), dtm, rec['file'].to_list()))
+    rec = rec.iloc[0]
+    if rec['valid'] != 1:
+        return None, None
+    pck = arc[int(rec['row'])] #zero-copy view of the packed masks, only unpacking reads from disk
+    sky = np.unpackbits(pck[0], axis=-1, count=int(rec['ncol'])).astype(bool)
+    lgap = np.unpackbits(pck[1], axis=-1, count=int(rec['ncol'])).astype(bool)
+    return sky, lgap
+
 ####-------------------PROGRAM-----------------####
-def get_PAI(indir):
+def get_PAI(indir, mskarc=0):
     '''
     Main process for retrieving PAI (inclusive of all plant matter not just leaves).
     '''
@@ -75,6 +104,7 @@ def get_PAI(indir):
     infn = len(inf)
     correctdt = xx.index.tolist() 
     dt, fn, leftmaxbin, leftmaxcount, rightmaxbin, rightmaxcount, lucl, rucl, skyidxl, gfl, minpixareal, ccl, cpl, pail, flll = [], [], [], [], [], [], [], [], [], [], [], [], [], [], []
+    arc, arcvl = None, [] #mask archive is created once the image size is known (first image), one chunk (row) per image
     
     # retrieve PAI for each photo
     for num, val in enumerate(inf):
@@ -89,6 +119,9 @@ def get_PAI(indir):
         arr1 = arr0[:-skipbotpix,:].copy() #truncates the nonimg part, copy in case operations modify the array.
         # arr1 = rescale(arr1,0.5,multichannel=True) # downscale if needed for speed
         arr = img_as_ubyte(arr1)
+        if mskarc == 1 and arc is None:
+            nrow, ncol = arr.shape[0], arr.shape[1]
+            arc = np.lib.format.open_memmap('2_mskarc_{0}.npy'.format(indir), mode='w+', dtype=np.uint8, shape=(infn, nmsk, nrow, (ncol+7)//8))
         
         # bin based on blue band
         counts, bins = np.histogram(arr[:,:,2], bins=bins_in) #only use blue channel
@@ -284,6 +317,14 @@ def get_PAI(indir):
                 minpixareal.append(-1)
             
             ccl.append(CC)
+            if mskarc == 1:
+                if arrbin.shape == (nrow, ncol): #images of a station should all be the same size, but don't let one odd image break the archive
+                    arc[num,0] = np.packbits(arrbin==1, axis=-1)
+                    arc[num,1] = np.packbits(cimg==255, axis=-1)
+                    arcvl.append(1)
+                else:
+                    print('image size {0} does not match mask archive size {1}, not archiving masks'.format(arrbin.shape, (nrow, ncol)))
+                    arcvl.append(0)
             print('large gap pixel (NL), clear, canopy pixel counts are %s, %s, %s or %s, %s, %s of image' %(lgc_cnt,clr_cnt,cnp_cnt,lgc_pct,clr_pct,cnp_pct))
             print('Faction of crown cover CC is %s' %CC)
             
@@ -345,6 +386,7 @@ def get_PAI(indir):
             pail.append(-1)
             minpixareal.append(-1)
             flll.append(-1)
+            arcvl.append(-1)
 
             fig, ax = plt.subplots(2,2, figsize=(9, 6))
             ax[0][0].title.set_text('Rosin (2001), up: {0}, lw: {1}, $\\Delta$: {2}, flg: {3}'.format('NA','NA','NA','NA'))
@@ -371,6 +413,13 @@ def get_PAI(indir):
             
             print('***could not classify, skipping calculations (check plot)*** \n')
         
+    #flush mask archive and write its index, so masks can be looked up by timestamp (see load_mskarc, get_msk)
+    if mskarc == 1 and arc is not None: #arc is None if there were no images to process
+        arc.flush()
+        del arc
+        arcidx = pd.DataFrame(data = {'file': fn, 'row': np.arange(infn), 'nrow': nrow, 'ncol': ncol, 'valid': arcvl}, index = dt)
+        arcidx.to_csv('2_mskarc_{0}.csv'.format(indir))
+
     #put important outputs to list and export as csv
     d = {'name': fn, 'lmxb': leftmaxbin, 'lmxc': leftmaxcount, 'rmxb': rightmaxbin, 'rmxc': rightmaxcount, 'rb_l': lucl, 'rb_r': rucl, 'sky': skyidxl, 'minpixarea': minpixareal, 'GF': gfl, 'CC': ccl, 'CP': cpl, 'PAI': pail, 'qc': flll}
     yy = pd.DataFrame(data = d, index = dt)
@@ -383,7 +432,7 @@ if __name__ == '__main__':
     csvout = '2_process_{0}.csv'.format(nme)
     cwd = os.getcwd()
     if os.path.exists(os.path.join(cwd,inps.indir,csvout)) == False:
-        yy = get_PAI(inps.indir)
+        yy = get_PAI(inps.indir, inps.mskarc)
         yy.to_csv(os.path.join(cwd,inps.indir,csvout))
     else:
         print('No new data, skipping calculation')